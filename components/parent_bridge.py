@@ -0,0 +1,87 @@
+# parent_bridge.py
+
+import os
+import uuid
+import streamlit as st
+import streamlit.components.v1 as components
+from langchain_core.messages import BaseMessage
+import logging
+logger = logging.getLogger(__name__)
+
+# --- Sequence-numbered delta sync with the embedding (Qualtrics) page ---
+# Every message has a sequence number (its index in the conversation). The parent page gets:
+#   {"type": "chat-sync",  "user_id", "seq", "messages"}            full snapshot (first run of a session / on demand)
+#   {"type": "chat-delta", "user_id", "base_seq", "seq", "messages"} only the messages newer than base_seq
+# The parent acknowledges with {"type": "chat-ack", "user_id", "seq"} and can ask for a full
+# snapshot with {"type": "chat-resync", "user_id"}. A resync request, or an ack whose seq differs
+# from the last seq sent, makes the bridge component report back to the server, which rebuilds
+# the snapshot from the history on that rerun.
+# {"type": "clear-chat", "user_id"} from the parent is answered with {"type": "chat-cleared", "user_id"}
+# and reported the same way; main.py then clears the history and an empty chat-sync follows.
+# Reports arrive as the component value {"event": "resync" | "clear", "id", "reason"} (see take_parent_request).
+#
+# Messages go through a (zero-height) component because Streamlit does not run <script> tags
+# passed to st.markdown; the component's iframe posts to window.parent.parent, the survey page.
+
+_parent_bridge = components.declare_component(
+    "parent_bridge",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "parent_bridge_frontend"),
+)
+
+
+def _serialize(messages: list[BaseMessage]) -> list[dict]:
+    return [{"role": m.type, "content": m.content} for m in messages]
+
+
+def take_parent_request() -> dict | None:
+    """
+    Returns the request the bridge component reported since it was last taken, or None.
+    Call once per run, before the history is read, so a clear takes effect in the same run.
+    """
+    request = st.session_state.get("parent_bridge")
+    if not request or request.get("id") == st.session_state.get("parent_request_handled"):
+        return None
+    st.session_state.parent_request_handled = request.get("id")
+    logger.info(f"take_parent_request: {request.get('event')} ({request.get('reason')})")
+    return request
+
+
+def reset_parent_sync() -> None:
+    """Forces a full snapshot on the next sync, even an empty one (on resync or after the history was cleared)."""
+    st.session_state.pop("parent_sync_seq", None)
+    st.session_state.parent_force_sync = True
+
+
+def sync_parent_window(user_id: str, conversation: list[BaseMessage]) -> None:
+    """
+    Sends the parent window what it has not seen yet. Must be called on every run, so the
+    bridge component stays mounted and can report resync and clear requests.
+
+    conversation is the full conversation as known to this run (history already read plus
+    this run's turn), so no extra DB read is needed; the delta is everything after the
+    parent_sync_seq last sent.
+    """
+    synced_seq = st.session_state.get("parent_sync_seq")
+    force = st.session_state.pop("parent_force_sync", False)
+
+    payload = None
+    if force or synced_seq is None or synced_seq > len(conversation):
+        # First run of this session, resync, or the history shrank (cleared): one full snapshot
+        messages = _serialize(conversation)
+        if messages or force or synced_seq is not None:
+            payload = {"type": "chat-sync", "user_id": user_id, "seq": len(messages), "messages": messages}
+            logger.info(f"sync_parent_window: Full sync for {user_id} at seq {len(messages)}")
+    elif synced_seq < len(conversation):
+        messages = _serialize(conversation[synced_seq:])
+        payload = {"type": "chat-delta", "user_id": user_id, "base_seq": synced_seq, "seq": len(conversation), "messages": messages}
+        logger.info(f"sync_parent_window: Delta for {user_id} seq {synced_seq} -> {len(conversation)}")
+    st.session_state.parent_sync_seq = len(conversation)
+
+    # Only the run that produced a payload sends it; other reruns re-render the bridge empty
+    _parent_bridge(
+        user_id=user_id,
+        payload=payload,
+        payload_id=str(uuid.uuid4()) if payload else None,
+        key="parent_bridge",
+        default=None,
+    )
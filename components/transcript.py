@@ -0,0 +1,90 @@
+# transcript.py
+
+import html
+from functools import lru_cache
+import streamlit as st
+from langchain_core.messages import BaseMessage
+import logging
+logger = logging.getLogger(__name__)
+
+USER_AVATAR_SVG = '<svg viewBox="0 0 24 24" fill="none"><circle cx="12" cy="8" r="4" fill="white"/><rect x="6" y="14" width="12" height="6" rx="3" fill="white"/></svg>'
+ASSISTANT_AVATAR_SVG = '<svg viewBox="0 0 24 24" fill="none"><circle cx="12" cy="12" r="9" fill="white"/><circle cx="12" cy="12" r="5" fill="#FFD700"/></svg>'
+
+
+# --- Per-message HTML, memoized by (type, content) ---
+# Content is escaped here, once, so the cached markup is always safe to reuse.
+@lru_cache(maxsize=4096)
+def message_html(msg_type: str, content: str) -> str:
+    escaped = html.escape(content).replace("\n", "<br>")
+    if msg_type == "human":
+        return (
+            '<div class="message-container user-container">'
+            f'<div class="user-avatar">{USER_AVATAR_SVG}</div>'
+            f'<div class="user-message">{escaped}</div>'
+            '</div>'
+        )
+    if msg_type == "ai":
+        return (
+            '<div class="message-container assistant-container">'
+            f'<div class="assistant-message">{escaped}</div>'
+            f'<div class="assistant-avatar">{ASSISTANT_AVATAR_SVG}</div>'
+            '</div>'
+        )
+    return ""
+
+
+# Messages per sealed transcript element. A sealed element never changes again, so reruns leave it
+# untouched in the browser; only the open tail element and the current turn's element change.
+CHUNK_SIZE = 20
+
+
+class TranscriptRenderer:
+    """
+    Renders the conversation as a few stable Streamlit elements: one per sealed chunk of
+    CHUNK_SIZE messages, one for the open tail, and a slot for the turn being answered.
+
+    The rendered parts and sealed chunks are kept in st.session_state, so a rerun only builds
+    markup for messages that were not rendered before; everything is rebuilt only if the history
+    no longer starts with what was rendered (e.g. after the chat was cleared).
+    Call render() once per run, then render_turn() for the new turn.
+    """
+
+    def __init__(self):
+        if "transcript_keys" not in st.session_state:
+            st.session_state.transcript_keys = []
+            st.session_state.transcript_parts = []
+            st.session_state.transcript_chunks = []
+        self.turn_slot = None
+
+    def _sync(self, messages: list[BaseMessage]) -> None:
+        keys = [(m.type, m.content) for m in messages]
+        rendered = st.session_state.transcript_keys
+        if keys[:len(rendered)] != rendered:
+            logger.info("TranscriptRenderer: History diverged from rendered transcript. Rebuilding.")
+            rendered = []
+            st.session_state.transcript_parts = []
+            st.session_state.transcript_chunks = []
+        for key in keys[len(rendered):]:
+            st.session_state.transcript_parts.append(message_html(*key))
+        st.session_state.transcript_keys = keys
+
+        parts, chunks = st.session_state.transcript_parts, st.session_state.transcript_chunks
+        while (len(chunks) + 1) * CHUNK_SIZE <= len(parts):
+            start = len(chunks) * CHUNK_SIZE
+            chunks.append("".join(parts[start:start + CHUNK_SIZE]))
+
+    def render(self, messages: list[BaseMessage]) -> None:
+        """Draws the stored conversation and reserves the slot for this run's turn."""
+        self._sync(messages)
+        for chunk in st.session_state.transcript_chunks:
+            st.markdown(chunk, unsafe_allow_html=True)
+        tail = st.session_state.transcript_parts[len(st.session_state.transcript_chunks) * CHUNK_SIZE:]
+        st.markdown("".join(tail), unsafe_allow_html=True)
+        self.turn_slot = st.empty()
+
+    def render_turn(self, turn: list[tuple[str, str]]) -> None:
+        """Draws the (type, content) pairs of the turn being answered, e.g. the user's message while waiting."""
+        if turn:
+            self.turn_slot.markdown("".join(message_html(msg_type, content) for msg_type, content in turn), unsafe_allow_html=True)
+        else:
+            self.turn_slot.empty()
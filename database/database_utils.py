@@ -30,13 +30,16 @@ def get_mongo_client_raw(mongo_uri: str):
 
 class MongoDBChatMessageHistory(BaseChatMessageHistory):
     # Pass survey_id, agent_id, response_id as attributes for the class instance
+    # turn_key is the idempotency key of the turn being written (session_id + client sequence number)
     def __init__(self, session_id: str, collection: Collection, 
-                 survey_id: str = "N/A", agent_id: str = "N/A", response_id: str = "N/A"):
+                 survey_id: str = "N/A", agent_id: str = "N/A", response_id: str = "N/A",
+                 turn_key: str | None = None):
         self.session_id = session_id
         self.collection = collection
         self.survey_id = survey_id
         self.agent_id = agent_id
         self.response_id = response_id
+        self.turn_key = turn_key
 
         logger.info(f"MongoDBChatMessageHistory.__init__: Initializing for session_id: {session_id}, ResponseID: {response_id}, AgentID: {agent_id}, SurveyID: {survey_id}")
 
@@ -76,6 +79,39 @@ class MongoDBChatMessageHistory(BaseChatMessageHistory):
             return retrieved_messages
         return []
 
+    def _ensure_document(self) -> None:
+        """Creates the session document (or repairs its 'messages' field) so that $push can be used safely."""
+        # 1. Define fields to set ONLY IF the document is newly inserted via upsert
+        set_on_insert_fields = {
+            "messages": [],  # Ensures messages array is created on first insert
+            "created_at": datetime.now(), 
+            "response_id": self.response_id, 
+            "agent_id": self.agent_id,       
+            "survey_id": self.survey_id      
+        }
+
+        # 2. Find the current document state
+        current_doc_state = self.collection.find_one({"session_id": self.session_id})
+
+        if not current_doc_state:
+            # Case A: Document does NOT exist (first message of a new chat)
+            # Insert it cleanly with all metadata and an empty messages array.
+            logger.info(f"_ensure_document: Document for session '{self.session_id}' not found. Inserting new document with initial metadata.")
+            initial_document = {
+                "session_id": self.session_id, # Ensure session_id is also set
+                **set_on_insert_fields # Unpack the fields defined for $setOnInsert
+            }
+            self.collection.insert_one(initial_document)
+            logger.info(f"_ensure_document: New document created for session '{self.session_id}'.")
+        elif not isinstance(current_doc_state.get("messages"), list):
+            # Case B: Document EXISTS, but 'messages' field is missing or not an array.
+            # This explicitly fixes a malformed 'messages' field.
+            logger.warning(f"_ensure_document: 'messages' field for session '{self.session_id}' is not an array. Fixing it to empty array.")
+            self.collection.update_one(
+                {"session_id": self.session_id},
+                {"$set": {"messages": []}}
+            )
+
     # MODIFIED: add_message now handles document creation atomically
     
     # FIX START: add_message is now more robust against initial document state
@@ -84,38 +120,9 @@ class MongoDBChatMessageHistory(BaseChatMessageHistory):
         logger.info(f"add_message: Attempting to add message for session {self.session_id}: {message_dict['content'][:50]}...")
         
         try:
-            # 1. Define fields to set ONLY IF the document is newly inserted via upsert
-            set_on_insert_fields = {
-                "messages": [],  # Ensures messages array is created on first insert
-                "created_at": datetime.now(), 
-                "response_id": self.response_id, 
-                "agent_id": self.agent_id,       
-                "survey_id": self.survey_id      
-            }
-
-            # 2. Find the current document state
-            current_doc_state = self.collection.find_one({"session_id": self.session_id})
-
-            if not current_doc_state:
-                # Case A: Document does NOT exist (first message of a new chat)
-                # Insert it cleanly with all metadata and an empty messages array.
-                logger.info(f"add_message: Document for session '{self.session_id}' not found. Inserting new document with initial metadata.")
-                initial_document = {
-                    "session_id": self.session_id, # Ensure session_id is also set
-                    **set_on_insert_fields # Unpack the fields defined for $setOnInsert
-                }
-                self.collection.insert_one(initial_document)
-                logger.info(f"add_message: New document created for session '{self.session_id}'.")
-            elif not isinstance(current_doc_state.get("messages"), list):
-                # Case B: Document EXISTS, but 'messages' field is missing or not an array.
-                # This explicitly fixes a malformed 'messages' field.
-                logger.warning(f"add_message: 'messages' field for session '{self.session_id}' is not an array. Fixing it to empty array.")
-                self.collection.update_one(
-                    {"session_id": self.session_id},
-                    {"$set": {"messages": []}}
-                )
+            self._ensure_document()
             
-            # 3. Now, the document is guaranteed to exist and its 'messages' field is an array (or will be created correctly).
+            # Now, the document is guaranteed to exist and its 'messages' field is an array (or will be created correctly).
             # We can safely push the message.
             result = self.collection.update_one(
                 {"session_id": self.session_id},
@@ -132,6 +139,54 @@ class MongoDBChatMessageHistory(BaseChatMessageHistory):
             # Re-raise the exception to ensure Streamlit logs it properly if it's not caught higher up.
             raise e 
     # FIX END
+
+    def add_messages(self, messages: list[BaseMessage]) -> None:
+        """
+        Writes a whole turn. When a turn_key is set, the messages and the turn record
+        are pushed in ONE update that only matches if the key has not been recorded yet,
+        so a replayed turn can never duplicate messages.
+        """
+        if self.turn_key is None:
+            for message in messages:
+                self.add_message(message)
+            return
+
+        message_dicts = [{"type": m.type, "content": m.content} for m in messages]
+        human_input = next((m["content"] for m in message_dicts if m["type"] == "human"), "")
+        ai_reply = next((m["content"] for m in reversed(message_dicts) if m["type"] == "ai"), "")
+        # Per-turn generation report attached by generation/length_governor.py, if any
+        length_report = next((m.response_metadata.get("length_governor") for m in reversed(messages)
+                              if m.type == "ai" and m.response_metadata.get("length_governor")), None)
+        logger.info(f"add_messages: Recording turn '{self.turn_key}' ({len(message_dicts)} messages) for session {self.session_id}")
+
+        try:
+            self._ensure_document()
+            result = self.collection.update_one(
+                {"session_id": self.session_id, "turns.key": {"$ne": self.turn_key}},
+                {"$push": {
+                    "messages": {"$each": message_dicts},
+                    "turns": {"key": self.turn_key, "input": human_input, "reply": ai_reply,
+                              "length_governor": length_report, "created_at": datetime.now()},
+                }}
+            )
+            if result.matched_count > 0:
+                logger.info(f"add_messages: Turn '{self.turn_key}' recorded for session {self.session_id}.")
+            else:
+                logger.warning(f"add_messages: Turn '{self.turn_key}' already recorded for session {self.session_id}. Skipping duplicate write.")
+        except Exception as e:
+            logger.error(f"add_messages: CRITICAL ERROR recording turn '{self.turn_key}' for session {self.session_id}: {e}", exc_info=True)
+            raise e
+
+    def get_turn(self, turn_key: str) -> dict | None:
+        """Returns the stored {'key', 'input', 'reply'} record for turn_key, or None if the turn was never written."""
+        doc = self.collection.find_one(
+            {"session_id": self.session_id, "turns.key": turn_key},
+            {"turns.$": 1, "_id": 0}
+        )
+        if doc and doc.get("turns"):
+            return doc["turns"][0]
+        return None
+
     def clear(self) -> None:
         logger.info(f"clear: Attempting to clear session: {self.session_id}")
         try:
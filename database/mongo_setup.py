@@ -22,4 +22,7 @@ def get_mongo_db_connection(mongo_uri: str, db_name: str, collection_name: str)
         return client, mongo_db, mongo_collection # Return all three objects
     except Exception as e:
         st.error(f"Could not connect to MongoDB Atlas: {e}. Please check your MONGO_URI.")
-        st.stop() # Stop the app if connection fails
\ No newline at end of file
+        st.stop() # Stop the app if connection fails
+        # st.stop() only requests a stop (and is a no-op outside a script run, e.g. the warm-up in serve.py),
+        # so re-raise: a failure must never be returned, or st.cache_resource would cache it
+        raise
\ No newline at end of file
@@ -0,0 +1,93 @@
+# turn_guard.py
+
+import threading
+from concurrent.futures import Future
+from typing import Callable
+from database.database_utils import MongoDBChatMessageHistory
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def make_turn_key(session_id: str, nonce: str) -> str:
+    """Idempotency key of a turn: the session id plus the nonce of the submission (see main.py)."""
+    return f"{session_id}:{nonce}"
+
+
+class TurnGuard:
+    """
+    Makes chat turns idempotent across Streamlit reruns and double submits.
+
+    A turn that was already recorded in MongoDB returns its stored reply instead of calling
+    the model again, and concurrent runs of the same turn wait on the one call already in flight.
+    One instance is shared by every script run of the process (see st.cache_resource in main.py).
+
+    Streamlit runs one script at a time per session, and a rerun only starts once the interrupted
+    run has returned from the model call, so replays are normally answered from MongoDB; the
+    in-flight table covers runs that overlap anyway (e.g. a session resumed in a second runner).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, tuple[str, Future]] = {}
+        self.suppressed_calls = 0
+
+    def _suppress(self, turn_key: str, reason: str) -> None:
+        with self._lock:
+            self.suppressed_calls += 1
+            total = self.suppressed_calls
+        logger.info(f"TurnGuard: Suppressed duplicate call for turn '{turn_key}' ({reason}). Total suppressed: {total}")
+
+    def run(self, turn_key: str, user_input: str, history: MongoDBChatMessageHistory,
+            generate: Callable[[], str]) -> tuple[str, bool] | None:
+        """
+        Returns (reply, replayed) for turn_key, calling generate() at most once per key.
+        replayed is True when the reply was not generated by this call.
+
+        Returns None if the key was already used for a DIFFERENT input, i.e. the nonce
+        is stale; the caller should draw a new one and try again.
+        """
+        stored = history.get_turn(turn_key)
+        if stored is not None:
+            if stored.get("input") != user_input:
+                logger.warning(f"TurnGuard: Turn '{turn_key}' was recorded for a different input. Nonce is stale.")
+                return None
+            self._suppress(turn_key, "already recorded")
+            return stored.get("reply", ""), True
+
+        with self._lock:
+            entry = self._in_flight.get(turn_key)
+            owner = entry is None
+            if owner:
+                future = Future()
+                self._in_flight[turn_key] = (user_input, future)
+            else:
+                in_flight_input, future = entry
+
+        if not owner:
+            if in_flight_input != user_input:
+                logger.warning(f"TurnGuard: Turn '{turn_key}' is in flight for a different input. Nonce is stale.")
+                return None
+            self._suppress(turn_key, "coalesced onto in-flight call")
+            result = future.result()
+            return None if result is None else (result[0], True)
+
+        try:
+            # Re-check under ownership: a previous owner may have recorded the turn and left
+            # the in-flight table between our first lookup and taking the lock.
+            stored = history.get_turn(turn_key)
+            if stored is None:
+                result = (generate(), False)
+            elif stored.get("input") == user_input:
+                self._suppress(turn_key, "recorded while waiting")
+                result = (stored.get("reply", ""), True)
+            else:
+                result = None
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(turn_key, None)
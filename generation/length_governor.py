@@ -0,0 +1,192 @@
+# length_governor.py
+
+import os
+import re
+import math
+import time
+import threading
+from functools import lru_cache
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableConfig
+import logging
+logger = logging.getLogger(__name__)
+
+# --- Output-length governor ---
+# Wraps the llm step of the RAG chain: caps max_tokens per conversation stage, streams the reply,
+# and closes the stream once the reply is over its word budget AND has reached a complete sentence
+# (see truncate_to_budget). Each turn's report (token counts, estimated tokens/ms saved) is stored
+# with the turn record in MongoDB.
+
+DEFAULT_STAGE = "default"
+CORE_MESSAGE_STAGE = "core_message"
+
+# A sentence ends at . ! ? … (followed by whitespace or the end of the text) or at a line break
+_SENTENCE_END = re.compile(r"[.!?…]+(?=\s|$)|\n")
+
+# Alex opens the Core Message story with a line like "btw something super embarrassing happened
+# yesterday" (the Transition stage in prompt.txt). The prompt also asks for deliberate typos, so the
+# default marker tolerates misspellings ("embarassing", "embarrasing", "embarased") and close rephrasings.
+CORE_MESSAGE_MARKER = re.compile(
+    os.getenv("CORE_MESSAGE_MARKER_REGEX", r"\bemb\w*r\w*s\w*|\bawkward|\bhumiliat|\bcringe"),
+    re.IGNORECASE,
+)
+
+# Fallback when no marker is found: Alex's reply numbers (1-based) that fall in the Core Message stage.
+# prompt.txt: greeting (1), 4 warm-up exchanges (2-5), transition, story, and the story's ending.
+CORE_MESSAGE_REPLIES = tuple(int(n) for n in os.getenv("CORE_MESSAGE_REPLIES", "6-8").split("-"))
+
+
+def detect_stage(history: list[BaseMessage], core_message_turns: int = 2,
+                 core_replies: tuple[int, int] = CORE_MESSAGE_REPLIES) -> str:
+    """
+    Core Message stage = the first `core_message_turns` replies after Alex announced the
+    embarrassing story (the story itself and, if the participant says no, its ending).
+    If no earlier reply matches CORE_MESSAGE_MARKER, the exchange count decides: the reply
+    about to be generated is in the stage if its number is within core_replies.
+    """
+    ai_messages = [m for m in history if m.type == "ai"]
+    for i, msg in enumerate(ai_messages):
+        if CORE_MESSAGE_MARKER.search(msg.content):
+            return CORE_MESSAGE_STAGE if len(ai_messages) - (i + 1) < core_message_turns else DEFAULT_STAGE
+    next_reply = len(ai_messages) + 1
+    return CORE_MESSAGE_STAGE if core_replies[0] <= next_reply <= core_replies[1] else DEFAULT_STAGE
+
+
+def truncate_to_budget(text: str, max_words: int, min_fraction: float = 0.5) -> str | None:
+    """
+    Where to stop a streaming reply. Returns the text to keep, or None to keep streaming.
+
+    Nothing is cut while the reply is within max_words. Once it is over budget, it is cut at the
+    last complete sentence within the budget, provided that keeps at least min_fraction of the
+    budget (so "hey. <25 more words>" is not reduced to "hey."); otherwise at the first sentence
+    end after the budget. With no usable sentence end the reply is left to finish on its own,
+    bounded by the stage's max_tokens cap, rather than stored as a mid-clause fragment.
+    """
+    words = list(re.finditer(r"\S+", text))
+    if len(words) <= max_words or max_words <= 0:
+        return None
+    budget_end = words[max_words - 1].end()
+    min_end = words[max(math.ceil(max_words * min_fraction), 1) - 1].end()
+
+    # A "." at the very end of a partial stream may still be "..." or "3.5"; wait for the next chunk
+    sentence_ends = [m.end() for m in _SENTENCE_END.finditer(text) if m.end() < len(text)]
+    within = [end for end in sentence_ends if min_end <= end <= budget_end + 1] # +1: a line break right after the last word
+    if within:
+        return text[:within[-1]].strip()
+    after = [end for end in sentence_ends if end > budget_end + 1]
+    if after:
+        return text[:after[0]].strip()
+    return None
+
+
+@lru_cache(maxsize=1)
+def _load_tokenizer():
+    """DashScope's Qwen tokenizer (needs tiktoken), or None to fall back to a character estimate."""
+    try:
+        from dashscope import get_tokenizer
+        return get_tokenizer("qwen-plus")
+    except Exception as e:
+        logger.warning(f"_load_tokenizer: Qwen tokenizer unavailable, estimating tokens from characters: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Qwen token count of text; ~4 characters per token when the tokenizer is unavailable."""
+    if not text:
+        return 0
+    tokenizer = _load_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+# Per stage: (count, total tokens) of replies that went over budget and were NOT stopped (no usable
+# sentence end), i.e. how long an over-budget reply runs when left alone. An early stop's saving is
+# estimated against this average; until a stage has such a sample, the saving is reported as None.
+_unstopped_lock = threading.Lock()
+_unstopped_over_budget: dict[str, tuple[int, int]] = {}
+
+
+def _record_unstopped(stage: str, tokens: int) -> None:
+    with _unstopped_lock:
+        count, total = _unstopped_over_budget.get(stage, (0, 0))
+        _unstopped_over_budget[stage] = (count + 1, total + tokens)
+
+
+def _expected_unstopped_tokens(stage: str) -> float | None:
+    with _unstopped_lock:
+        count, total = _unstopped_over_budget.get(stage, (0, 0))
+    return total / count if count else None
+
+
+class LengthGovernor:
+    """
+    Calls the chat model with a per-stage token cap and stops streaming once the reply is over
+    its word budget and at a sentence end. stage_limits maps a stage name to {"max_words": int, "max_tokens": int};
+    the stage of a call comes from config["configurable"]["stage"] (DEFAULT_STAGE if missing).
+    """
+
+    def __init__(self, llm: BaseChatModel, stage_limits: dict[str, dict]):
+        if DEFAULT_STAGE not in stage_limits:
+            raise ValueError(f"stage_limits must define the '{DEFAULT_STAGE}' stage")
+        self.llm = llm
+        self.stage_limits = stage_limits
+
+    def __call__(self, prompt: PromptValue, config: RunnableConfig) -> AIMessage:
+        stage = config.get("configurable", {}).get("stage", DEFAULT_STAGE)
+        limits = self.stage_limits.get(stage, self.stage_limits[DEFAULT_STAGE])
+        max_words, max_tokens = limits["max_words"], limits["max_tokens"]
+
+        text = ""
+        stopped_early = False
+        started = time.perf_counter()
+        first_token_at = None
+
+        stream = self.llm.stream(prompt, config=config, max_tokens=max_tokens)
+        try:
+            for chunk in stream:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                text += chunk.content if isinstance(chunk.content, str) else ""
+
+                truncated = truncate_to_budget(text, max_words)
+                if truncated is not None:
+                    stopped_early = True
+                    break
+        finally:
+            stream.close() # Closes the HTTP stream, which stops generation on the provider side
+
+        # DashScope chunks carry no usage and hold several tokens each, so count the streamed text itself
+        tokens_generated = count_tokens(text)
+        kept = truncated if stopped_early else text
+        decode_ms = (time.perf_counter() - first_token_at) * 1000 if first_token_at else 0.0
+        ms_per_token = decode_ms / tokens_generated if tokens_generated else 0.0
+
+        tokens_saved = ms_saved = None
+        if stopped_early:
+            expected = _expected_unstopped_tokens(stage)
+            if expected is not None:
+                tokens_saved = round(max(min(expected, max_tokens) - tokens_generated, 0))
+                ms_saved = round(tokens_saved * ms_per_token, 1)
+        else:
+            tokens_saved = ms_saved = 0
+            if len(text.split()) > max_words:
+                _record_unstopped(stage, tokens_generated)
+
+        report = {
+            "stage": stage,
+            "max_words": max_words,
+            "max_tokens": max_tokens,
+            "words": len(kept.split()),
+            "tokens_generated": tokens_generated, # including any tail streamed past the cut
+            "tokens_kept": count_tokens(kept),
+            "stopped_early": stopped_early,
+            "tokens_saved_est": tokens_saved, # vs. the average unstopped over-budget reply of this stage; None until known
+            "ms_saved_est": ms_saved,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        logger.info(f"LengthGovernor: {report}")
+        # Stored with the turn record by MongoDBChatMessageHistory.add_messages
+        return AIMessage(content=kept, response_metadata={"length_governor": report})
@@ -27,7 +27,7 @@ import os
 import json
 import uuid
 from langchain_chroma.vectorstores import Chroma
-from rag.retriever import get_retriever
+from rag.retriever import get_retriever, PERSIST_DIRECTORY, COLLECTION_NAME
 from langchain_community.chat_models.tongyi import ChatTongyi
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
@@ -38,6 +38,13 @@ from langchain_core.runnables import RunnableParallel, RunnablePassthrough
 from operator import itemgetter
 from database.database_utils import get_mongo_client_raw, MongoDBChatMessageHistory
 from database.mongo_setup import get_mongo_db_connection
+from startup.secrets_loader import get_secret, load_aws_secrets_into_env
+from database.turn_guard import TurnGuard, make_turn_key
+from components.parent_bridge import sync_parent_window, reset_parent_sync, take_parent_request
+from components.transcript import TranscriptRenderer
+from generation.length_governor import LengthGovernor, detect_stage, DEFAULT_STAGE, CORE_MESSAGE_STAGE
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables import ConfigurableFieldSpec
 import boto3
 import json
 import streamlit as st
@@ -74,32 +81,9 @@ def get_query_param_value(param_key: str, default_val: str = "N/A") -> str:
     logger.info(param_list)
     return param_list # Return the first value from the list
 
-# Function to get secrets (from previous example)
-def get_secrets_from_aws(secret_name="alex_secrets", region_name="us-east-2"):
-    client = boto3.client('secretsmanager', region_name=region_name)
-    try:
-        get_secret_value_response = client.get_secret_value(SecretId=secret_name)
-    except Exception as e:
-        st.error(f"Failed to retrieve secret '{secret_name}' from AWS Secrets Manager: {e}")
-        return {} # Return empty dict on error
-    return json.loads(get_secret_value_response['SecretString'])
-
 # Load secrets from AWS (e.g., Secrets Manager) at application startup
-# This block runs when Streamlit starts the script
-if "aws_secrets_loaded" not in st.session_state:
-    aws_secrets = get_secrets_from_aws()
-    for key, value in aws_secrets.items():
-        os.environ[key] = value # Make them available as environment variables
-    st.session_state.aws_secrets_loaded = True
-    # For sensitive items, you might want to remove them from os.environ after st.secrets has picked them up
-    # However, for simplicity, leaving them in os.environ is common.
-
-def get_secret(key):
-    # Try to get from Streamlit secrets (for deployed apps)
-    if key in st.secrets:
-        return st.secrets[key]
-    # Fallback to os.getenv (for local development with .env)
-    return os.getenv(key)
+# Fetched once per process (usually already done by the warm-up in serve.py)
+load_aws_secrets_into_env()
 
 # --- MongoDB Atlas Connection Details & Client ---
 DASHSCOPE_API_KEY = get_secret("DASHSCOPE_API_KEY")
@@ -176,7 +160,7 @@ survey_id=get_query_param_value("surveyId")
 
 
 
-retriever = get_retriever(persist_directory="./new_characteristics", collection_name="social_experiment", _openai_api_key=OPENAI_API_KEY)
+retriever = get_retriever(persist_directory=PERSIST_DIRECTORY, collection_name=COLLECTION_NAME, _openai_api_key=OPENAI_API_KEY)
 
 # 唯一用户ID
 if "user_id" not in st.session_state:
@@ -188,15 +172,23 @@ if "user_id" not in st.session_state:
 user_id = st.session_state.user_id
 
 # 历史工厂：为每个用户单独创建
-def history_factory(session_id):
+def history_factory(session_id, turn_key=None):
     return MongoDBChatMessageHistory(
         session_id=session_id, 
         collection=mongo_collection,
         response_id=response_id,
         agent_id=agent_id,
-        survey_id=survey_id
+        survey_id=survey_id,
+        turn_key=turn_key
            )
 
+# One guard per process so duplicate turns from any rerun/tab coalesce onto a single LLM call
+@st.cache_resource
+def get_turn_guard() -> TurnGuard:
+    return TurnGuard()
+
+turn_guard = get_turn_guard()
+
 # 提示模板
 rag_prompt = ChatPromptTemplate.from_messages([
    ("system", """
@@ -220,6 +212,18 @@ rag_prompt = ChatPromptTemplate.from_messages([
     ("human", "{input}"), # For the current user input
 ])
 
+# Output-length budget per conversation stage ("under 20 words" in the prompt above).
+# The Core Message story is legitimately longer; override its budget with CORE_MESSAGE_MAX_WORDS / CORE_MESSAGE_MAX_TOKENS
+# and its detection with CORE_MESSAGE_MARKER_REGEX / CORE_MESSAGE_REPLIES (see generation/length_governor.py).
+STAGE_LIMITS = {
+    DEFAULT_STAGE: {"max_words": 20, "max_tokens": 60},
+    CORE_MESSAGE_STAGE: {
+        "max_words": int(os.getenv("CORE_MESSAGE_MAX_WORDS", "80")),
+        "max_tokens": int(os.getenv("CORE_MESSAGE_MAX_TOKENS", "200")),
+    },
+}
+length_governor = LengthGovernor(llm, STAGE_LIMITS)
+
 # Building the RAG Chain
 # This chain first retrieves context, then formats the prompt, and then passes it to the LLM.
 # RunnableParallel allows independent branches to run concurrently.
@@ -233,7 +237,7 @@ rag_chain = (
         }
     )
     | rag_prompt # Apply the RAG-aware prompt template
-    | llm        # Send to the Language Model
+    | RunnableLambda(length_governor) # Send to the Language Model, capped and stopped at the stage's word budget
 )
 
 
@@ -244,116 +248,87 @@ chain_with_history = RunnableWithMessageHistory(
     history_factory,
     input_messages_key="input",
     history_messages_key="history",
+    history_factory_config=[
+        ConfigurableFieldSpec(id="session_id", annotation=str, name="Session ID", default="", is_shared=True),
+        ConfigurableFieldSpec(id="turn_key", annotation=str, name="Turn Key", default=None, is_shared=True),
+    ],
 )
 
 # 标题
 st.header("Alex")
 
+# 清除聊天 / resync requests from the parent page, reported by the bridge component (see components/parent_bridge.py)
+parent_request = take_parent_request()
+if parent_request and parent_request.get("event") == "clear":
+    history_factory(user_id).clear()
+    st.session_state.pending_turn = None
+    reset_parent_sync()
+elif parent_request and parent_request.get("event") == "resync":
+    reset_parent_sync()
+
 # 获取当前用户的历史记录
 current_history = history_factory(user_id)
 
-# 先渲染所有已有消息
-for msg in current_history.messages:
-    if msg.type == "human":
-        st.markdown(f'''
-        <div class="message-container user-container">
-            <div class="user-avatar">
-                <svg viewBox="0 0 24 24" fill="none"><circle cx="12" cy="8" r="4" fill="white"/><rect x="6" y="14" width="12" height="6" rx="3" fill="white"/></svg>
-            </div>
-            <div class="user-message">{msg.content}</div>
-        </div>
-        ''', unsafe_allow_html=True)
-    elif msg.type == "ai":
-        st.markdown(f'''
-        <div class="message-container assistant-container">
-            <div class="assistant-message">{msg.content}</div>
-            <div class="assistant-avatar">
-                <svg viewBox="0 0 24 24" fill="none"><circle cx="12" cy="12" r="9" fill="white"/><circle cx="12" cy="12" r="5" fill="#FFD700"/></svg>
-            </div>
-        </div>
-        ''', unsafe_allow_html=True)
-        
-
-
-# 用户输入处理
+# Read the history once per run; it is reused for rendering and the parent-window sync
+history_messages = current_history.messages
+
+# 用户输入处理 (read before rendering so each run draws the transcript exactly once;
+# chat_input stays pinned to the bottom of the page regardless of call order)
+turn_key = None
+turn_messages = []
+turn_in_history = False
 user_input = st.chat_input("Type your message...")
+
+# Each submission gets a nonce that is kept until its reply has been shown, so a double submit or
+# a chat_input resent after a reconnect repeats the same turn key instead of starting a new turn.
+pending_turn = st.session_state.get("pending_turn")
+if pending_turn and not user_input and current_history.get_turn(make_turn_key(user_id, pending_turn["nonce"])):
+    # The run that answered it was interrupted after the write; the reply is now shown from history
+    st.session_state.pending_turn = pending_turn = None
+if user_input and (not pending_turn or pending_turn["input"] != user_input):
+    st.session_state.pending_turn = pending_turn = {"nonce": str(uuid.uuid4()), "input": user_input}
+
+# 先渲染所有已有消息 (stable elements; only messages not rendered before are formatted)
+transcript = TranscriptRenderer()
+transcript.render(history_messages)
+
 if user_input:
     # 立即显示用户消息
-    st.markdown(f'''
-    <div class="message-container user-container">
-        <div class="user-avatar">
-            <svg viewBox="0 0 24 24" fill="none"><circle cx="12" cy="8" r="4" fill="white"/><rect x="6" y="14" width="12" height="6" rx="3" fill="white"/></svg>
-        </div>
-        <div class="user-message">{user_input}</div>
-    </div>
-    ''', unsafe_allow_html=True)
+    transcript.render_turn([("human", user_input)])
     
     # 获取模型响应
     
     try:
-        response = chain_with_history.invoke(
-            {"input": user_input},
-            config={"configurable": {"session_id": user_id}}
-        )
-        # 显示AI回复
-        st.markdown(f'''
-        <div class="message-container assistant-container">
-            <div class="assistant-message">{response.content}</div>
-            <div class="assistant-avatar">
-                <svg viewBox="0 0 24 24" fill="none"><circle cx="12" cy="12" r="9" fill="white"/><circle cx="12" cy="12" r="5" fill="#FFD700"/></svg>
-            </div>
-        </div>
-        ''', unsafe_allow_html=True)
+        # Idempotent turn: a rerun/double submit of the same turn returns the stored reply
+        result = None
+        while result is None:
+            turn_key = make_turn_key(user_id, pending_turn["nonce"])
+            result = turn_guard.run(
+                turn_key,
+                user_input,
+                current_history,
+                lambda: chain_with_history.invoke(
+                    {"input": user_input},
+                    config={"configurable": {"session_id": user_id, "turn_key": turn_key, "stage": detect_stage(history_messages)}}
+                ).content,
+            )
+            if result is None:
+                # Nonce is stale (key used by another input); draw a new one
+                st.session_state.pending_turn = pending_turn = {"nonce": str(uuid.uuid4()), "input": user_input}
+        reply, replayed = result
+        turn_messages = [HumanMessage(content=user_input), AIMessage(content=reply)]
+        # A replayed turn recorded before this run read the history is already its last exchange
+        turn_in_history = replayed and [(m.type, m.content) for m in history_messages[-2:]] == [("human", user_input), ("ai", reply)]
+        logger.info(f"Turn '{turn_key}' done. Suppressed duplicate LLM calls so far: {turn_guard.suppressed_calls}")
+        # 显示AI回复 (only this turn's element changes; a turn already in history is drawn by the transcript)
+        transcript.render_turn([] if turn_in_history else [("human", user_input), ("ai", reply)])
+        st.session_state.pending_turn = None # Reply shown; the next submission is a new turn
 
     except Exception as e:
         # 显示错误信息
-        st.markdown(f'''
-        <div class="message-container assistant-container">
-            <div class="assistant-message">Error: {str(e)}</div>
-            <div class="assistant-avatar">
-                <svg viewBox="0 0 24 24" fill="none"><circle cx="12" cy="12" r="9" fill="white"/><circle cx="12" cy="12" r="5" fill="#FFD700"/></svg>
-            </div>
-        </div>
-        ''', unsafe_allow_html=True)
-
-# 父窗口通信
-current_history = history_factory(user_id)  # 重新获取最新历史记录
-if current_history.messages:
-    message = {
-        "type": "chat-update",
-        "user_id": user_id,
-        "messages": [{"role": m.type, "content": m.content} for m in current_history.messages]
-    }
-    js_code = f"""
-    <script>
-        window.parent.postMessage({json.dumps(message)}, "*");
-    </script>
-    """
-    st.markdown(js_code, unsafe_allow_html=True)
-
-# 清除聊天处理程序
-st.markdown(f"""
-<script>
-    window.addEventListener('message', function(event) {{
-        if (event.data.type === 'clear-chat' && event.data.user_id === '{user_id}') {{
-            const url = new URL(window.location);
-            url.searchParams.set('clear_chat_history_db', '{user_id}');
-            window.parent.postMessage({{type: 'chat-cleared', user_id: '{user_id}'}}, '*');
-            window.location.href = url.toString();
-        }}
-    }});
-</script>
-""", unsafe_allow_html=True)
-
-# --- Streamlit Internal Function to Clear DB History ---
-if st.runtime.exists():
-    query_params = st.query_params
-    if "clear_chat_history_db" in query_params:
-        session_id_to_clear = query_params["clear_chat_history_db"][0]
-        history_factory(session_id_to_clear).clear()
-        
-        new_query_params = {k: v for k, v in query_params.items() if k != "clear_chat_history_db"}
-        st.experimental_set_query_params(**new_query_params)
-        
-        st.rerun()
+        transcript.render_turn([("human", user_input), ("ai", f"Error: {str(e)}")])
 
+# 父窗口通信: full snapshot on the first run (or on resync), afterwards only the new messages.
+# A replayed turn already in history_messages must not be counted twice.
+conversation = history_messages if turn_in_history else history_messages + turn_messages
+sync_parent_window(user_id, conversation)
@@ -5,6 +5,10 @@ from langchain_community.vectorstores import Chroma
 from langchain_openai.embeddings import OpenAIEmbeddings
 from langchain_core.utils.utils import convert_to_secret_str
 
+# Location of the knowledge base built by vector_stores.py (shared by main.py and the warm-up in serve.py)
+PERSIST_DIRECTORY = "./new_characteristics"
+COLLECTION_NAME = "social_experiment"
+
 # --- RAG Setup: Load Vector Store and Create Retriever ---
 # This function encapsulates all RAG setup (embeddings, Chroma load, retriever config)
 @st.cache_resource(show_spinner="Loading AI knowledge base...") # Show spinner while loading
@@ -0,0 +1,41 @@
+# serve.py
+# Container entry point: starts the readiness probe and the warm-up, then runs the Streamlit
+# app IN THIS PROCESS so the warmed imports and st.cache_resource caches are the ones main.py uses.
+#   python serve.py [streamlit flags...]
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Same sqlite3 swap as main.py; it has to happen before the warm-up imports chromadb
+import sys
+try:
+    __import__('pysqlite3')
+    sys.modules['sqlite3'] = sys.modules['pysqlite3']
+    logger.info("--- pysqlite3 fix applied successfully (from logger) ---")
+except ImportError:
+    logger.warning("--- WARNING: pysqlite3 not found or failed to import. Falling back to system sqlite3. ---")
+
+import os
+import threading
+from startup.warmup import run_warmup, start_readiness_server
+
+READINESS_PORT = int(os.getenv("READINESS_PORT", "8502"))
+WARMUP_POOL_SIZE = int(os.getenv("WARMUP_POOL_SIZE", "5"))
+
+def get_streamlit_port(args: list[str], default: int = 8501) -> int:
+    """Port Streamlit will listen on, from a --server.port flag among args (the Dockerfile passes one)."""
+    for i, arg in enumerate(args):
+        if arg.startswith("--server.port="):
+            return int(arg.split("=", 1)[1])
+        if arg == "--server.port" and i + 1 < len(args):
+            return int(args[i + 1])
+    return int(os.getenv("STREAMLIT_SERVER_PORT", default))
+
+if __name__ == "__main__":
+    start_readiness_server(READINESS_PORT, streamlit_port=get_streamlit_port(sys.argv[1:]))
+    threading.Thread(target=run_warmup, kwargs={"pool_size": WARMUP_POOL_SIZE}, name="warmup", daemon=True).start()
+
+    from streamlit.web import cli as stcli
+    sys.argv = ["streamlit", "run", "main.py", *sys.argv[1:]]
+    sys.exit(stcli.main())
@@ -0,0 +1,56 @@
+# secrets_loader.py
+
+import os
+import json
+import time
+import threading
+import boto3
+import streamlit as st
+import logging
+logger = logging.getLogger(__name__)
+
+# Secrets are fetched from AWS once per PROCESS (not once per browser session),
+# so the warm-up in serve.py and every script run share the same fetch.
+# A failed or empty fetch is remembered too and only retried after SECRETS_RETRY_SECONDS,
+# so an AWS outage doesn't cost every rerun a boto3 client, credential-chain timeouts and an st.error.
+SECRETS_RETRY_SECONDS = float(os.getenv("SECRETS_RETRY_SECONDS", "60"))
+
+_secrets_lock = threading.Lock()
+_secrets_loaded = False
+_secrets_failed_at = None
+
+# Function to get secrets (from previous example)
+def get_secrets_from_aws(secret_name="alex_secrets", region_name="us-east-2"):
+    client = boto3.client('secretsmanager', region_name=region_name)
+    try:
+        get_secret_value_response = client.get_secret_value(SecretId=secret_name)
+    except Exception as e:
+        st.error(f"Failed to retrieve secret '{secret_name}' from AWS Secrets Manager: {e}")
+        return {} # Return empty dict on error
+    return json.loads(get_secret_value_response['SecretString'])
+
+def load_aws_secrets_into_env() -> None:
+    """Copies the AWS secrets into os.environ, fetching them only on the first call."""
+    global _secrets_loaded, _secrets_failed_at
+    with _secrets_lock:
+        if _secrets_loaded:
+            return
+        if _secrets_failed_at is not None and time.monotonic() - _secrets_failed_at < SECRETS_RETRY_SECONDS:
+            return # Still backing off after a failed fetch
+        aws_secrets = get_secrets_from_aws()
+        for key, value in aws_secrets.items():
+            os.environ[key] = value # Make them available as environment variables
+        if aws_secrets:
+            _secrets_loaded = True
+            _secrets_failed_at = None
+            logger.info(f"load_aws_secrets_into_env: Loaded {len(aws_secrets)} secrets from AWS.")
+        else:
+            _secrets_failed_at = time.monotonic()
+            logger.warning(f"load_aws_secrets_into_env: No secrets loaded from AWS. Retrying in {SECRETS_RETRY_SECONDS:.0f}s at the earliest.")
+
+def get_secret(key):
+    # Try to get from Streamlit secrets (for deployed apps)
+    if key in st.secrets:
+        return st.secrets[key]
+    # Fallback to os.getenv (for local development with .env)
+    return os.getenv(key)
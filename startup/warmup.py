@@ -0,0 +1,187 @@
+# warmup.py
+
+import json
+import time
+import importlib
+import urllib.request
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+logger = logging.getLogger(__name__)
+
+# --- Process warm-up ---
+# Runs once at process start (see serve.py), in the same process as the Streamlit server, so that
+# sys.modules and the st.cache_resource caches used by main.py are already filled when the
+# first participant arrives. The readiness endpoint only answers 200 once this has finished.
+
+# Heavy modules main.py imports. A module shared by several entries is charged to the first one.
+HEAVY_MODULES = [
+    "streamlit",
+    "pymongo",
+    "boto3",
+    "langchain_core",
+    "langchain",
+    "langchain_community.chat_models.tongyi",
+    "langchain_openai.embeddings",
+    "chromadb",
+    "langchain_chroma.vectorstores",
+]
+
+_status_lock = threading.Lock()
+_status = {
+    "warm": False,
+    "attempts": 0,
+    "error": None,         # last warm-up error, cleared once warm
+    "next_retry_in": None, # seconds, while backing off
+    "steps": {},           # step name -> seconds
+    "import_profile": [],  # [{"module", "seconds"}], slowest first
+}
+
+
+def get_warmup_status() -> dict:
+    with _status_lock:
+        return json.loads(json.dumps(_status))
+
+
+def _record_step(name: str, started: float) -> None:
+    elapsed = round(time.perf_counter() - started, 3)
+    with _status_lock:
+        _status["steps"][name] = elapsed
+    logger.info(f"warmup: {name} done in {elapsed}s")
+
+
+def profile_imports(modules: list[str] = HEAVY_MODULES) -> list[dict]:
+    """Imports each module and returns the time it took, slowest first."""
+    profile = []
+    for module in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.warning(f"profile_imports: Could not import {module}: {e}")
+            continue
+        profile.append({"module": module, "seconds": round(time.perf_counter() - started, 3)})
+    profile.sort(key=lambda entry: entry["seconds"], reverse=True)
+
+    report = "\n".join(f"    {entry['seconds']:>8.3f}s  {entry['module']}" for entry in profile)
+    logger.info(f"profile_imports: Import-time profile (total {sum(e['seconds'] for e in profile):.3f}s):\n{report}")
+    return profile
+
+
+def fill_mongo_pool(client, size: int) -> None:
+    """Opens `size` pooled connections by pinging concurrently, so the first turns don't pay for TCP/TLS setup."""
+    with ThreadPoolExecutor(max_workers=size) as pool:
+        list(pool.map(lambda _: client.admin.command('ping'), range(size)))
+
+
+def _warm_dependencies(pool_size: int) -> None:
+    """Secrets, MongoDB and the retriever; raises if any of them is unavailable."""
+    # Imported here so the import profile measures them cold
+    from dotenv import load_dotenv
+    from startup.secrets_loader import get_secret, load_aws_secrets_into_env
+    from database.mongo_setup import get_mongo_db_connection
+    from rag.retriever import get_retriever, PERSIST_DIRECTORY, COLLECTION_NAME
+
+    started = time.perf_counter()
+    load_dotenv()
+    load_aws_secrets_into_env()
+    _record_step("secrets", started)
+
+    # Same arguments as main.py, so these calls fill the very cache entries main.py reads.
+    # On any failure the cached entry is dropped, so neither the next attempt nor main.py reuses it.
+    started = time.perf_counter()
+    try:
+        connection = get_mongo_db_connection(
+            mongo_uri=get_secret("MONGO_URI"),
+            db_name=get_secret("MONGO_DB_NAME"),
+            collection_name=get_secret("MONGO_COLLECTION_NAME"),
+        )
+        if connection is None:
+            raise ConnectionError("get_mongo_db_connection returned no connection")
+        mongo_client, _, _ = connection
+        fill_mongo_pool(mongo_client, pool_size)
+    except BaseException:
+        get_mongo_db_connection.clear()
+        raise
+    _record_step("mongo", started)
+
+    started = time.perf_counter()
+    retriever = get_retriever(persist_directory=PERSIST_DIRECTORY, collection_name=COLLECTION_NAME, _openai_api_key=get_secret("OPENAI_API_KEY"))
+    retriever.invoke("hello") # Dummy retrieval: loads the Chroma index and warms the embeddings client
+    _record_step("retriever", started)
+
+
+def run_warmup(pool_size: int = 5, initial_backoff: float = 2.0, max_backoff: float = 60.0) -> None:
+    """
+    Performs every cold-start cost of main.py once, retrying with exponential backoff until it
+    succeeds, so a short MongoDB/AWS/OpenAI outage at deploy time doesn't strand the replica.
+    Marks the process warm on success.
+    """
+    started = time.perf_counter()
+    profile = profile_imports()
+    with _status_lock:
+        _status["import_profile"] = profile
+    _record_step("imports", started)
+
+    backoff = initial_backoff
+    while True:
+        with _status_lock:
+            _status["attempts"] += 1
+            attempt = _status["attempts"]
+        try:
+            _warm_dependencies(pool_size)
+            break
+        except BaseException as e: # st.stop() raises a non-Exception; retry rather than dying
+            logger.error(f"warmup: Attempt {attempt} FAILED, retrying in {backoff:.0f}s: {e}", exc_info=True)
+            with _status_lock:
+                _status["error"] = str(e) or type(e).__name__
+                _status["next_retry_in"] = backoff
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+    with _status_lock:
+        _status["warm"] = True
+        _status["error"] = None
+        _status["next_retry_in"] = None
+    logger.info(f"warmup: Process is warm after {attempt} attempt(s).")
+
+
+def streamlit_is_healthy(port: int, timeout: float = 1.0) -> bool:
+    """True if the Streamlit server in this process answers its own health check."""
+    try:
+        with urllib.request.urlopen(f"http://localhost:{port}/_stcore/health", timeout=timeout) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+
+class _ReadinessHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/ready":
+            self.send_error(404)
+            return
+        status = get_warmup_status()
+        status["streamlit_healthy"] = streamlit_is_healthy(self.server.streamlit_port)
+        status["ready"] = status["warm"] and status["streamlit_healthy"]
+        body = json.dumps(status).encode()
+        self.send_response(200 if status["ready"] else 503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Load balancer probes would flood the log
+
+
+def start_readiness_server(port: int, streamlit_port: int = 8501) -> ThreadingHTTPServer:
+    """
+    Serves GET /ready on `port`: 200 once the process is warm AND Streamlit answers on
+    streamlit_port, 503 otherwise (still warming, backing off after a failed attempt, or Streamlit down).
+    """
+    server = ThreadingHTTPServer(("0.0.0.0", port), _ReadinessHandler)
+    server.streamlit_port = streamlit_port
+    threading.Thread(target=server.serve_forever, name="readiness-server", daemon=True).start()
+    logger.info(f"start_readiness_server: Readiness probe listening on :{port}/ready")
+    return server
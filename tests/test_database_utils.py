@@ -0,0 +1,99 @@
+from unittest.mock import MagicMock
+from langchain_core.messages import AIMessage, HumanMessage
+from database.database_utils import MongoDBChatMessageHistory
+
+
+def make_history(existing_doc=None, turn_key="s1:n1", matched_count=1):
+    """A real MongoDBChatMessageHistory on a MagicMock collection holding at most one document."""
+    collection = MagicMock()
+    collection.find_one.return_value = existing_doc
+    collection.update_one.return_value = MagicMock(matched_count=matched_count)
+    history = MongoDBChatMessageHistory(
+        session_id="s1", collection=collection,
+        survey_id="sv", agent_id="ag", response_id="rs", turn_key=turn_key,
+    )
+    collection.reset_mock()
+    collection.find_one.return_value = existing_doc
+    collection.update_one.return_value = MagicMock(matched_count=matched_count)
+    return history, collection
+
+
+def test_history_can_be_instantiated_and_cleared():
+    history, collection = make_history({"session_id": "s1", "messages": []})
+    collection.delete_one.return_value = MagicMock(deleted_count=1)
+    history.clear()
+    collection.delete_one.assert_called_once_with({"session_id": "s1"})
+    inserted = collection.insert_one.call_args.args[0]
+    assert inserted["session_id"] == "s1" and inserted["messages"] == []
+
+
+def test_ensure_document_inserts_missing_session_with_metadata():
+    history, collection = make_history(None)
+    history._ensure_document()
+    inserted = collection.insert_one.call_args.args[0]
+    assert inserted["session_id"] == "s1"
+    assert inserted["messages"] == []
+    assert (inserted["response_id"], inserted["agent_id"], inserted["survey_id"]) == ("rs", "ag", "sv")
+    collection.update_one.assert_not_called()
+
+
+def test_ensure_document_repairs_malformed_messages():
+    history, collection = make_history({"session_id": "s1", "messages": "oops"})
+    history._ensure_document()
+    collection.insert_one.assert_not_called()
+    collection.update_one.assert_called_once_with({"session_id": "s1"}, {"$set": {"messages": []}})
+
+
+def test_ensure_document_leaves_valid_document_alone():
+    history, collection = make_history({"session_id": "s1", "messages": []})
+    history._ensure_document()
+    collection.insert_one.assert_not_called()
+    collection.update_one.assert_not_called()
+
+
+def test_add_messages_writes_turn_in_one_conditional_update():
+    history, collection = make_history({"session_id": "s1", "messages": []})
+    report = {"stage": "default", "tokens_generated": 7}
+    history.add_messages([HumanMessage(content="hi"), AIMessage(content="hey", response_metadata={"length_governor": report})])
+
+    collection.update_one.assert_called_once()
+    filter_doc, update_doc = collection.update_one.call_args.args
+    assert filter_doc == {"session_id": "s1", "turns.key": {"$ne": "s1:n1"}}
+    assert set(update_doc) == {"$push"}
+    assert update_doc["$push"]["messages"] == {"$each": [{"type": "human", "content": "hi"}, {"type": "ai", "content": "hey"}]}
+    turn = update_doc["$push"]["turns"]
+    assert (turn["key"], turn["input"], turn["reply"], turn["length_governor"]) == ("s1:n1", "hi", "hey", report)
+
+
+def test_add_messages_replay_is_skipped_not_duplicated():
+    history, collection = make_history({"session_id": "s1", "messages": []}, matched_count=0)
+    history.add_messages([HumanMessage(content="hi"), AIMessage(content="hey")])
+
+    # The only write is the guarded update; no unconditional $push or insert follows the miss
+    collection.update_one.assert_called_once()
+    assert collection.update_one.call_args.args[0]["turns.key"] == {"$ne": "s1:n1"}
+    collection.insert_one.assert_not_called()
+
+
+def test_add_messages_without_turn_key_pushes_each_message():
+    history, collection = make_history({"session_id": "s1", "messages": []}, turn_key=None)
+    history.add_messages([HumanMessage(content="hi"), AIMessage(content="hey")])
+
+    pushes = [c.args for c in collection.update_one.call_args_list]
+    assert pushes == [
+        ({"session_id": "s1"}, {"$push": {"messages": {"type": "human", "content": "hi"}}}),
+        ({"session_id": "s1"}, {"$push": {"messages": {"type": "ai", "content": "hey"}}}),
+    ]
+
+
+def test_get_turn_uses_positional_projection():
+    stored = {"key": "s1:n1", "input": "hi", "reply": "hey"}
+    history, collection = make_history({"turns": [stored]})
+
+    assert history.get_turn("s1:n1") == stored
+    collection.find_one.assert_called_once_with({"session_id": "s1", "turns.key": "s1:n1"}, {"turns.$": 1, "_id": 0})
+
+
+def test_get_turn_returns_none_for_unknown_key():
+    history, collection = make_history(None)
+    assert history.get_turn("s1:missing") is None
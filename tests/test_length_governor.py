@@ -0,0 +1,127 @@
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+import generation.length_governor as length_governor
+from generation.length_governor import (
+    LengthGovernor, truncate_to_budget, detect_stage, count_tokens, DEFAULT_STAGE, CORE_MESSAGE_STAGE,
+)
+
+TWENTY = " ".join(f"w{i}" for i in range(1, 21))
+
+
+def test_within_budget_is_not_cut():
+    assert truncate_to_budget("hi im alex whats up", 20) is None
+    assert truncate_to_budget(TWENTY, 20) is None
+
+
+def test_cuts_at_last_sentence_end_within_budget():
+    text = "omg hi im alex and i love how u think about stuff. ur so thoughtful tbh i wish i was like that more often"
+    assert truncate_to_budget(text, 20) == "omg hi im alex and i love how u think about stuff."
+
+
+def test_line_break_counts_as_sentence_end():
+    text = "omg hi im alex and i love how u think about stuff\nur so thoughtful tbh i wish i was like that more often"
+    assert truncate_to_budget(text, 20) == "omg hi im alex and i love how u think about stuff"
+
+
+def test_no_sentence_end_keeps_streaming_instead_of_cutting_mid_clause():
+    text = "omg thats so cool i love that u do that honestly ur like the most interesting person ive talked to all week fr"
+    assert truncate_to_budget(text, 20) is None
+
+
+def test_short_leading_sentence_is_not_kept_alone():
+    text = "hey. " + " ".join(["so"] * 25) + " "
+    assert truncate_to_budget(text, 20) is None
+
+
+def test_cuts_at_first_sentence_end_after_budget():
+    text = "hey. " + " ".join(["so"] * 22) + " done! and then more words"
+    assert truncate_to_budget(text, 20) == "hey. " + " ".join(["so"] * 22) + " done!"
+
+
+def test_trailing_period_of_partial_stream_is_not_final():
+    text = "hey. " + " ".join(["so"] * 22) + " version 3."
+    assert truncate_to_budget(text, 20) is None
+
+
+class FakeStreamingModel:
+    """Yields the reply word by word and records whether the stream was closed early."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.yielded = 0
+        self.max_tokens = None
+
+    def stream(self, prompt, config=None, max_tokens=None):
+        self.max_tokens = max_tokens
+        for word in self.reply.split(" "):
+            self.yielded += 1
+            yield AIMessageChunk(content=word + " ")
+
+
+def test_governor_stops_stream_at_sentence_end():
+    model = FakeStreamingModel("omg hi im alex and i love how u think about stuff. ur so thoughtful tbh i wish i was like that more often and more and more and more")
+    governor = LengthGovernor(model, {DEFAULT_STAGE: {"max_words": 20, "max_tokens": 60}})
+
+    message = governor(None, {"configurable": {}})
+
+    assert message.content == "omg hi im alex and i love how u think about stuff."
+    assert model.max_tokens == 60
+    assert model.yielded < len(model.reply.split(" "))
+    assert message.response_metadata["length_governor"]["stopped_early"] is True
+
+
+def test_governor_lets_unpunctuated_reply_finish():
+    reply = "omg thats so cool i love that u do that honestly ur like the most interesting person ive talked to all week fr"
+    governor = LengthGovernor(FakeStreamingModel(reply), {DEFAULT_STAGE: {"max_words": 20, "max_tokens": 60}})
+
+    message = governor(None, {"configurable": {}})
+
+    assert message.content.strip() == reply
+    assert message.response_metadata["length_governor"]["stopped_early"] is False
+
+
+def conversation(*ai_replies):
+    history = []
+    for reply in ai_replies:
+        history += [HumanMessage(content="..."), AIMessage(content=reply)]
+    return history
+
+
+def test_stage_follows_marker_for_two_replies():
+    warmup = ["hi im alex whats up", "nice", "cool", "haha same"]
+    assert detect_stage(conversation(*warmup, "btw something super embarrassing happened yesterday")) == CORE_MESSAGE_STAGE
+    assert detect_stage(conversation(*warmup, "btw something super embarrassing happened yesterday", "so the story")) == CORE_MESSAGE_STAGE
+    assert detect_stage(conversation(*warmup, "btw something super embarrassing happened yesterday", "so the story", "the end")) == DEFAULT_STAGE
+
+
+def test_stage_marker_tolerates_typos():
+    for transition in ["btw something super embarassing happend", "btw smth EMBARRASING happened", "omg so awkward what happened yesterday"]:
+        assert detect_stage(conversation("hi", transition)) == CORE_MESSAGE_STAGE
+
+
+def test_stage_falls_back_to_exchange_count_without_marker():
+    assert detect_stage(conversation("hi", "nice", "cool")) == DEFAULT_STAGE
+    assert detect_stage(conversation("hi", "nice", "cool", "same", "lol")) == CORE_MESSAGE_STAGE
+    assert detect_stage(conversation(*["ok"] * 8)) == DEFAULT_STAGE
+
+
+def test_count_tokens_falls_back_to_characters(monkeypatch):
+    monkeypatch.setattr(length_governor, "_load_tokenizer", lambda: None)
+    assert count_tokens("") == 0
+    assert count_tokens("abcdefgh") == 2
+    assert count_tokens("abcdefghi") == 3
+
+
+def test_saving_is_unknown_until_an_unstopped_reply_is_seen(monkeypatch):
+    monkeypatch.setattr(length_governor, "_load_tokenizer", lambda: None)
+    monkeypatch.setattr(length_governor, "_unstopped_over_budget", {})
+    limits = {DEFAULT_STAGE: {"max_words": 20, "max_tokens": 200}}
+    stoppable = "omg hi im alex and i love how u think about stuff. ur so thoughtful tbh i wish i was like that more often and more"
+    unpunctuated = " ".join(["word"] * 60)
+
+    first = LengthGovernor(FakeStreamingModel(stoppable), limits)(None, {"configurable": {}})
+    assert first.response_metadata["length_governor"]["tokens_saved_est"] is None
+
+    LengthGovernor(FakeStreamingModel(unpunctuated), limits)(None, {"configurable": {}})
+    report = LengthGovernor(FakeStreamingModel(stoppable), limits)(None, {"configurable": {}}).response_metadata["length_governor"]
+    assert report["tokens_saved_est"] == count_tokens(unpunctuated + " ") - report["tokens_generated"]
+    assert report["tokens_kept"] == count_tokens(first.content)
@@ -0,0 +1,126 @@
+import time
+import threading
+from database.turn_guard import TurnGuard, make_turn_key
+
+
+class FakeHistory:
+    """Stands in for MongoDBChatMessageHistory: only the turn records TurnGuard reads."""
+
+    def __init__(self):
+        self.turns = {}
+
+    def get_turn(self, turn_key):
+        return self.turns.get(turn_key)
+
+    def record(self, turn_key, user_input, reply):
+        self.turns[turn_key] = {"key": turn_key, "input": user_input, "reply": reply}
+
+
+def make_generate(history, turn_key, user_input, reply, calls, release=None, started=None):
+    def generate():
+        calls.append(turn_key)
+        if started is not None:
+            started.set()
+        if release is not None:
+            release.wait(timeout=5)
+        history.record(turn_key, user_input, reply)
+        return reply
+    return generate
+
+
+def test_make_turn_key_combines_session_and_nonce():
+    assert make_turn_key("user-1", "abc") == "user-1:abc"
+
+
+def test_first_call_generates():
+    history, guard, calls = FakeHistory(), TurnGuard(), []
+    key = make_turn_key("s", "n1")
+
+    result = guard.run(key, "hi", history, make_generate(history, key, "hi", "hey there", calls))
+
+    assert result == ("hey there", False)
+    assert calls == [key]
+    assert guard.suppressed_calls == 0
+
+
+def test_replay_returns_stored_reply_without_generating():
+    history, guard, calls = FakeHistory(), TurnGuard(), []
+    key = make_turn_key("s", "n1")
+    guard.run(key, "hi", history, make_generate(history, key, "hi", "hey there", calls))
+
+    result = guard.run(key, "hi", history, make_generate(history, key, "hi", "other reply", calls))
+
+    assert result == ("hey there", True)
+    assert calls == [key]
+    assert guard.suppressed_calls == 1
+
+
+def test_stale_key_for_different_input_returns_none():
+    history, guard, calls = FakeHistory(), TurnGuard(), []
+    key = make_turn_key("s", "n1")
+    history.record(key, "hi", "hey there")
+
+    result = guard.run(key, "something else", history, make_generate(history, key, "something else", "x", calls))
+
+    assert result is None
+    assert calls == []
+    assert guard.suppressed_calls == 0
+
+
+def test_concurrent_duplicates_coalesce_onto_one_call():
+    history, guard, calls = FakeHistory(), TurnGuard(), []
+    key = make_turn_key("s", "n1")
+    release, started = threading.Event(), threading.Event()
+    generate = make_generate(history, key, "hi", "hey there", calls, release, started)
+    results = []
+
+    owner = threading.Thread(target=lambda: results.append(guard.run(key, "hi", history, generate)))
+    owner.start()
+    assert started.wait(timeout=5), "owner never entered generate()"
+    waiters = [threading.Thread(target=lambda: results.append(guard.run(key, "hi", history, generate))) for _ in range(3)]
+    for t in waiters:
+        t.start()
+    time.sleep(0.2) # Let the waiters pass the MongoDB lookup and block on the in-flight call
+    assert history.get_turn(key) is None
+    release.set()
+    for t in [owner, *waiters]:
+        t.join(timeout=5)
+
+    assert calls == [key]
+    assert sorted(results) == [("hey there", False)] + [("hey there", True)] * 3
+    assert guard.suppressed_calls == 3
+
+
+def test_concurrent_duplicate_with_different_input_is_stale():
+    history, guard, calls = FakeHistory(), TurnGuard(), []
+    key = make_turn_key("s", "n1")
+    release, started = threading.Event(), threading.Event()
+    results = []
+
+    owner = threading.Thread(target=lambda: results.append(
+        guard.run(key, "hi", history, make_generate(history, key, "hi", "hey there", calls, release, started))))
+    owner.start()
+    assert started.wait(timeout=5), "owner never entered generate()"
+    # While the owner is in flight, the record is not written yet, so only the in-flight table can tell
+    assert guard.run(key, "bye", history, make_generate(history, key, "bye", "x", calls)) is None
+    release.set()
+    owner.join(timeout=5)
+
+    assert calls == [key]
+    assert results == [("hey there", False)]
+
+
+def test_failed_generation_is_not_cached():
+    history, guard = FakeHistory(), TurnGuard()
+    key = make_turn_key("s", "n1")
+
+    def failing():
+        raise RuntimeError("model down")
+
+    try:
+        guard.run(key, "hi", history, failing)
+    except RuntimeError:
+        pass
+    calls = []
+    assert guard.run(key, "hi", history, make_generate(history, key, "hi", "hey there", calls)) == ("hey there", False)
+    assert calls == [key]